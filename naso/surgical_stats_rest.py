@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Surgical IoMT Port Statistics REST API (Ryu)
+=============================================
+Companion app to surgical_controller.py that serves cached OpenFlow
+port counters to the network profiler (tracer_logger.py).
+
+Features:
+- Controller-driven sampling: one OFPPortStatsRequest per switch every
+  STATS_INTERVAL seconds over the existing OpenFlow channel
+- Replies are cached, so REST reads never touch the switch
+- GET /stats/port/<dpid> returns the same JSON layout as ryu.app.ofctl_rest
+
+Usage:
+    ryu-manager surgical_controller.py surgical_stats_rest.py
+
+Requirements:
+- Ryu >= 4.0
+- REST API listens on 0.0.0.0:8080 (Ryu wsgi default)
+"""
+
+import json
+
+from ryu.app.wsgi import ControllerBase, WSGIApplication, route
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import DEAD_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+from webob import Response
+
+STATS_INTERVAL = 1  # Seconds between port-stats requests to each switch
+STATS_APP_INSTANCE = 'surgical_stats_app'
+
+
+class SurgicalPortStats13(app_manager.RyuApp):
+    """
+    Periodically collects port statistics from every connected switch.
+
+    The profiler reads the latest reply over REST instead of forking
+    ovs-ofctl/ovs-vsctl on every sample.
+    """
+
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'wsgi': WSGIApplication}
+
+    def __init__(self, *args, **kwargs):
+        super(SurgicalPortStats13, self).__init__(*args, **kwargs)
+        self.datapaths = {}   # {dpid: datapath}
+        self.port_stats = {}  # {dpid: [port counters dict]}
+
+        wsgi = kwargs['wsgi']
+        wsgi.register(PortStatsController, {STATS_APP_INSTANCE: self})
+        self.monitor_thread = hub.spawn(self._monitor)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange,
+                [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        """Track connected switches so the monitor knows whom to poll."""
+        datapath = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+            self.port_stats.pop(datapath.id, None)
+
+    def _monitor(self):
+        """Request port stats from every switch every STATS_INTERVAL."""
+        while True:
+            for datapath in list(self.datapaths.values()):
+                parser = datapath.ofproto_parser
+                req = parser.OFPPortStatsRequest(
+                    datapath, 0, datapath.ofproto.OFPP_ANY)
+                datapath.send_msg(req)
+            hub.sleep(STATS_INTERVAL)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        """Cache the latest counters of every port on the replying switch."""
+        self.port_stats[ev.msg.datapath.id] = [{
+            'port_no': stat.port_no,
+            'rx_packets': stat.rx_packets,
+            'tx_packets': stat.tx_packets,
+            'rx_bytes': stat.rx_bytes,
+            'tx_bytes': stat.tx_bytes,
+            'rx_dropped': stat.rx_dropped,
+            'tx_dropped': stat.tx_dropped,
+            'rx_errors': stat.rx_errors,
+            'tx_errors': stat.tx_errors,
+            'duration_sec': stat.duration_sec,
+            'duration_nsec': stat.duration_nsec,
+        } for stat in ev.msg.body]
+
+
+class PortStatsController(ControllerBase):
+    """REST endpoint serving the cached port counters."""
+
+    def __init__(self, req, link, data, **config):
+        super(PortStatsController, self).__init__(req, link, data, **config)
+        self.stats_app = data[STATS_APP_INSTANCE]
+
+    @route('portstats', '/stats/port/{dpid}', methods=['GET'],
+           requirements={'dpid': r'[0-9]+'})
+    def get_port_stats(self, req, dpid, **kwargs):
+        """
+        Return {"<dpid>": [port counters, ...]} for a switch.
+
+        Args:
+            dpid: Datapath ID in decimal (as in ryu.app.ofctl_rest)
+        """
+        dpid = int(dpid)
+        if dpid not in self.stats_app.port_stats:
+            return Response(status=404)
+
+        body = json.dumps({str(dpid): self.stats_app.port_stats[dpid]})
+        return Response(content_type='application/json', text=body)
@@ -1,117 +1,344 @@
+import os
+import sys
 import time
 import csv
 import re
+import json
+import signal
+import atexit
+import threading
 import subprocess
+import concurrent.futures
+
+import numpy as np
+import requests
 
 # --- CONFIGURATION ---
 DURATION = 3600       # 1 Hour
 INTERVAL = 5          # Target interval between samples
 OUTPUT_FILE = "network_trace.csv"
+BINARY_FILE = "network_trace.f32"  # Same rows as float32, NCOLS per row
 IPERF_FREQ = 5        # Run iperf only every N iterations to reduce load
+BUSY_MBPS = 20        # Skip iperf while switch traffic averages above this
+BUSY_WINDOW = 3       # Number of recent samples used for the busy check
+WINDOW = 720          # In-memory ring of recent samples (1 hour at 5 s)
+FLUSH_EVERY = 12      # Flush CSV to disk every N rows (~once per minute)
+STATS_REST = "http://127.0.0.1:8080"  # surgical_stats_rest.py on the controller
+OVSDB_STATS_PERIOD = 5  # ovs-vswitchd stats-update-interval (seconds, minimum)
+LOGGER_CORE = os.cpu_count() - 1 if os.cpu_count() else None  # Core the logger (and its iperf) is pinned to
+
+# --- PRECOMPILED PATTERNS (parsed every tick) ---
+_RE_PING = re.compile(r"([\d.]+)% packet loss.*?rtt [^=]*=\s*[\d.]+/([\d.]+)/[\d.]+/([\d.]+) ms", re.S)
+_RE_TX = re.compile(r"\btx_bytes=(\d+)")
+_RE_RX = re.compile(r"\brx_bytes=(\d+)")
+_RE_DROP = re.compile(r"\btx_dropped=(\d+)")
+_RE_RSSI = re.compile(r"signal:\s*(-\d+)")
+_RE_CPU = re.compile(r"^cpu +([\d ]+)", re.M)
+_RE_MEMTOTAL = re.compile(r"^MemTotal:\s+(\d+)", re.M)
+_RE_MEMAVAIL = re.compile(r"^MemAvailable:\s+(\d+)", re.M)
+
+# --- TRACE ROW LAYOUT ---
+# Fixed-width CSV fields: every data row has the same length, so the trace
+# can be sliced by byte offset instead of parsed. Widths cover the expected
+# ranges (rates up to ~1 Gbps in bytes/sec, drops up to 12 digits).
+# congestion_state is written as its LABEL_CODES number (0/1/2), not the
+# label name, so the last field is fixed-width too.
+ROW_FORMAT = ("{:10d},{:10.3f},{:10.3f},{:10.2f},{:10.2f},{:12d},"
+              "{:14.1f},{:14.1f},{:6d},{:10.2f},{:10.2f},{:1d}\n")
+# BINARY_FILE stores the same LABEL_CODES number; load it for training with
+# np.memmap(BINARY_FILE, dtype=np.float32, mode="r").reshape(-1, NCOLS)
+LABEL_CODES = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
+NCOLS = 12
 
-# --- TOPOLOGY REFERENCES (MUST MATCH YOUR MAIN SCRIPT) ---
-# Ensure sta3, sta4, ap1 are defined in your global scope before running this
-# sta3 = Client (Surgical Device)
-# sta4 = Edge Server (Processing Node)
-# ap1  = Access Point / Switch
 # --- TOPOLOGY REFERENCES ---
-try:
-    CLIENT_STA = sta3           # Surgical robot (wireless)
-    SERVER_STA = fog1           # Edge server (wired) <-- CHANGED
-    SWITCH_AP = ap1         
-    SERVER_IP = "10.0.0.100"    # Fog1's IP <-- CHANGED
-except NameError:
-    print("ERROR: sta3, fog1, or ap1 not defined.")
-    exit(1)
+# Set by _setup() from the arguments of run()
+CLIENT_STA = None   # Surgical robot (wireless), e.g. sta3
+SERVER_STA = None   # Edge server (wired), e.g. fog1
+SWITCH_AP = None    # Access Point / Switch, e.g. ap1
+SERVER_IP = None    # Edge server IP, e.g. "10.0.0.100"
+
+# --- NODE COMMAND LOCKS ---
+# Probes run concurrently, but every Mininet node talks to a single shell
+# over a PTY: commands on the same node must be serialized, while commands
+# on different nodes can overlap. Filled in by _setup().
+_NODE_LOCKS = {}
+
+def _cmd(node, command):
+    with _NODE_LOCKS[node]:
+        return node.cmd(command)
+
+# Server CPU jiffies from the previous sample (primed in _setup())
+_prev_cpu_idle, _prev_cpu_total = 0, 0
+
+# --- ONE-TIME SETUP ---
+_PROBE_SCRIPT = "/tmp/probe.sh"
+_IPERF_PIDFILE = "/tmp/tracer_iperf3.pid"
+
+# Keep-alive HTTP session to the controller's port-stats REST API
+_HTTP = requests.Session()
+_STOP_EVENT = None   # Set by stop() to end a run started with start()
+_THREAD = None       # Thread of the last start()
+# Held for the whole of a run(): a second run would rebind the node
+# globals and locks, reset SAMPLES and reopen the same output files
+_RUN_LOCK = threading.Lock()
+
+def _setup(client, server, switch, server_ip, core):
+    """
+    Runs once before the loop: binds the topology nodes, builds every
+    per-tick command string, writes the client probe script and starts the
+    iperf3 listener, so the loop itself only reads these constants.
+    """
+    global CLIENT_STA, SERVER_STA, SWITCH_AP, SERVER_IP
+    global _RSSI_CMD, _PING_CMD, _PROBE_CMD, _IPERF_ARGS, _SWITCH_CMD, _SERVER_CMD
+    global _STATS_URL, _SWITCH_DPID, _SWITCH_PORT, _SWITCH_IFACE, _SWITCH_SOURCE
+    global _sample_idx, _sample_count, _prev_cpu_idle, _prev_cpu_total
+    
+    CLIENT_STA, SERVER_STA, SWITCH_AP, SERVER_IP = client, server, switch, server_ip
+    
+    # A second run() in the same Python process (e.g. from the Mininet CLI)
+    # must not see the previous run's samples
+    SAMPLES[:] = 0
+    _sample_idx = _sample_count = 0
+    for node in (CLIENT_STA, SERVER_STA, SWITCH_AP):
+        _NODE_LOCKS[node] = threading.Lock()
+    
+    # Prime the CPU baseline with a real read first thing, so the first
+    # row's CPU% covers the rest of the setup instead of the time since boot
+    _SERVER_CMD = "cat /proc/stat /proc/meminfo"
+    _prev_cpu_idle, _prev_cpu_total = _cpu_jiffies(_cmd(SERVER_STA, _SERVER_CMD)) or (0, 0)
+    
+    # Station interface is fixed for the whole run
+    _RSSI_CMD = "iw dev {} station dump".format(CLIENT_STA.wintfs[0].name)
+    
+    # Discarded warm-up echo first: after idle it may pay for ARP resolution
+    # and inflate min/avg/mdev of the measured packets.
+    # Then -c 3 (3 packets), -i 0.2 (fast interval), -q (summary only)
+    _PING_CMD = ("ping -c 1 -W 1 {0} >/dev/null 2>&1; "
+                 "ping -c 3 -i 0.2 -q {0}".format(SERVER_IP))
+    
+    # Ping + RSSI both run on the client: batch them in one script so a tick
+    # costs a single PTY round-trip on that node. Sections are split on the
+    # sentinel lines in Python.
+    with open(_PROBE_SCRIPT, "w") as script:
+        script.write("echo '---LAT---'\n{}\necho '---RSSI---'\n{}\n".format(_PING_CMD, _RSSI_CMD))
+    _PROBE_CMD = "sh {}".format(_PROBE_SCRIPT)
+    
+    # --connect-timeout (ms): an unreachable server fails the probe quickly
+    # instead of leaving it hanging in connect()
+    _IPERF_ARGS = ["iperf3", "-c", SERVER_IP, "-t", "1", "-J",
+                   "--connect-timeout", "1000"]
+    if core is not None:
+        # Keep the probe on the logger's core (-A = iperf3 CPU affinity)
+        _IPERF_ARGS += ["-A", str(core)]
+    # AP uplink towards the fog server, taken from the topology link itself
+    links = SWITCH_AP.connectionsTo(SERVER_STA)
+    if not links:
+        raise RuntimeError("No link between {} and {}: cannot resolve the "
+                           "switch uplink".format(SWITCH_AP.name, SERVER_STA.name))
+    _SWITCH_IFACE = links[0][0].name
+    
+    # OVSDB statistics of the uplink: flat key=value pairs, no
+    # human-formatted dump-ports table to parse
+    _SWITCH_CMD = ("ovs-vsctl --bare --columns=statistics list Interface "
+                   "{}".format(_SWITCH_IFACE))
+    
+    # Same uplink as seen by the controller: decimal DPID + OpenFlow port
+    _SWITCH_DPID = str(int(SWITCH_AP.dpid, 16))
+    _STATS_URL = "{}/stats/port/{}".format(STATS_REST, _SWITCH_DPID)
+    ofport = SWITCH_AP.cmd("ovs-vsctl get Interface {} ofport".format(_SWITCH_IFACE)).strip()
+    try:
+        _SWITCH_PORT = int(ofport)
+    except ValueError:
+        raise RuntimeError("Cannot read the OpenFlow port of {}: {!r}".format(_SWITCH_IFACE, ofport))
+    _SWITCH_SOURCE = _pick_switch_source()
+    
+    # Single persistent iperf3 listener on the server for all bandwidth probes.
+    # -D detaches it from the node shell, so keep its PID (-I) to stop it
+    # again in run(); a leftover daemon from a crashed run is stopped first.
+    _stop_iperf_server()
+    SERVER_STA.cmd("iperf3 -s -D -I {}".format(_IPERF_PIDFILE))
+
+def _stop_iperf_server():
+    _cmd(SERVER_STA, "[ -f {0} ] && kill $(cat {0}) 2>/dev/null; rm -f {0}".format(_IPERF_PIDFILE))
 
 # --- HELPER FUNCTIONS ---
 
-def get_ping_stats():
+def parse_ping_stats(out):
+    # Single scan over the -q summary:
+    # "... 0% packet loss ...\nrtt min/avg/max/mdev = 1.2/3.4/5.6/0.7 ms"
+    # No rtt line (e.g. 100% loss) or no output -> high loss
+    m = _RE_PING.search(out)
+    return (float(m[2]), float(m[3]), float(m[1])) if m else (0.0, 0.0, 100.0)
+
+def start_bandwidth_probe():
+    """
+    Launches a 1 second iperf3 test (-J: JSON output) against the daemon
+    started in _setup() without waiting for it; collect the result with
+    finish_bandwidth_probe() on a later tick. Uses popen rather than the
+    node shell, so it neither blocks nor holds the client's command lock.
+    """
     try:
-        # -c 3 (3 packets), -i 0.2 (fast interval) -> ~1 second total
-        out = CLIENT_STA.cmd("ping -c 3 -i 0.2 {}".format(SERVER_IP))
-        latency = jitter = loss = 0.0
-        
-        if "packet loss" in out:
-            loss_part = out.split("packet loss")[1].split("%")[0]
-            loss = float(loss_part.split()[-1])
-        
-        if "rtt" in out:
-            # Format: rtt min/avg/max/mdev = 1.2/3.4/5.6/0.7 ms
-            rtt_part = out.split("rtt")[1].split("=")[1].split("/")
-            latency = float(rtt_part[1])
-            jitter = float(rtt_part[3].split()[0])
-            
-        return latency, jitter, loss
+        return CLIENT_STA.popen(_IPERF_ARGS, stderr=subprocess.DEVNULL)
     except Exception as e:
-        return 0.0, 0.0, 100.0 # Return high loss on error
+        return None
 
-def get_bandwidth():
+def finish_bandwidth_probe(proc, deadline):
+    """
+    Receiver-side goodput in Mbps of a finished probe, or None if it is
+    still running (poll() never blocks the loop). A probe that failed
+    (iperf3 -J reports {"error": ...}, bad JSON) or is still running past
+    `deadline` (monotonic) gives -1.0: not measured, like a skipped probe.
+    """
+    if proc.poll() is None:
+        if time.monotonic() < deadline:
+            return None
+        # Hung probe: kill it so later ticks can launch new ones
+        proc.kill()
+        proc.wait()
+        return -1.0
     try:
-        # Use iperf3 if available, else iperf. -t 1 (1 second test)
-        out = CLIENT_STA.cmd("iperf3 -c {} -t 1 -P 1 2>/dev/null".format(SERVER_IP))
-        # Handle both "Mbits/sec" and "Mbit/sec"
-        m = re.search(r"(\d+\.\d+)\s*Mbits?/sec", out)
-        return float(m.group(1)) if m else 0.0
+        stdout, _ = proc.communicate(timeout=0.1)
+        result = json.loads(stdout)
+        return result["end"]["sum_received"]["bits_per_second"] / 1e6
     except Exception as e:
-        return 0.0
+        return -1.0
+
+def _pick_switch_source():
+    """
+    Chooses the switch counter source once per run, so a trace never mixes
+    REST and OVSDB counters. The REST app only has counters after its first
+    poll of the switch, so give it a few seconds before falling back.
+    """
+    for attempt in range(3):
+        try:
+            _get_switch_stats_rest()
+            print("Switch counters: controller REST ({})".format(_STATS_URL))
+            return "rest"
+        except Exception as e:
+            time.sleep(1)
+    print("Switch counters: OVSDB ({}), REST API not reachable".format(_SWITCH_IFACE))
+    if INTERVAL <= OVSDB_STATS_PERIOD:
+        print("WARNING: OVSDB refreshes statistics every {}s; with INTERVAL={}s "
+              "switch rates will alias".format(OVSDB_STATS_PERIOD, INTERVAL))
+    return "ovsdb"
 
 def get_switch_stats():
+    """
+    (tx_bytes, rx_bytes, tx_dropped, stamp) of the AP uplink from the source
+    chosen in _setup(), or None if this sample failed. stamp is in seconds
+    and only meaningful as a difference between two samples.
+    """
+    if _SWITCH_SOURCE == "rest":
+        try:
+            return _get_switch_stats_rest()
+        except Exception as e:
+            return None
+    return get_switch_stats_ovsdb()
+
+def _get_switch_stats_rest():
+    # Counters the controller already collects (surgical_stats_rest.py).
+    # They can be up to STATS_INTERVAL old, so the stamp is the port's
+    # duration from the same reply instead of the logger's clock.
+    ports = _HTTP.get(_STATS_URL, timeout=0.5).json()[_SWITCH_DPID]
+    for port in ports:
+        if port["port_no"] == _SWITCH_PORT:
+            return (port["tx_bytes"], port["rx_bytes"], port["tx_dropped"],
+                    port["duration_sec"] + port["duration_nsec"] / 1e9)
+    raise KeyError("port {} not in stats reply".format(_SWITCH_PORT))
+
+def get_switch_stats_ovsdb():
+    """
+    (tx_bytes, rx_bytes, tx_dropped, stamp) of the AP uplink from OVSDB,
+    or None if the sample failed; stamp is the logger's monotonic clock.
+    
+    Note: ovs-vswitchd only refreshes Interface.statistics every
+    other_config:stats-update-interval (default and minimum 5000 ms), so
+    with INTERVAL <= OVSDB_STATS_PERIOD consecutive samples can see the
+    same counters (rate 0) followed by two periods' worth (rate ~2x).
+    Prefer the controller's REST counters, which are refreshed every second.
+    """
     try:
         # Call ONCE and parse both queue drops and bytes
-        out = SWITCH_AP.cmd("ovs-ofctl dump-ports {}".format(SWITCH_AP))
-        
-        tx_bytes = rx_bytes = drops = 0
+        # Output example: "collisions=0 rx_bytes=1234 ... tx_dropped=0 ..."
+        out = _cmd(SWITCH_AP, _SWITCH_CMD)
+        stamp = time.monotonic()
         
         # Parse TX/RX
-        tx_match = re.search(r"tx_bytes=(\d+)", out)
-        rx_match = re.search(r"rx_bytes=(\d+)", out)
-        drop_match = re.search(r"drop=(\d+)", out) # Might vary by OVS version
+        tx_match = _RE_TX.search(out)
+        rx_match = _RE_RX.search(out)
+        drop_match = _RE_DROP.search(out) # Egress (queue) drops
+        if not (tx_match and rx_match):
+            return None
         
-        tx_bytes = int(tx_match.group(1)) if tx_match else 0
-        rx_bytes = int(rx_match.group(1)) if rx_match else 0
+        tx_bytes = int(tx_match.group(1))
+        rx_bytes = int(rx_match.group(1))
         drops = int(drop_match.group(1)) if drop_match else 0
         
-        return tx_bytes, rx_bytes, drops
+        return tx_bytes, rx_bytes, drops, stamp
     except Exception as e:
-        return 0, 0, 0
+        return None
 
-def get_wireless_rssi():
+def parse_wireless_rssi(out):
     try:
-        # Get signal strength for wireless station
-        # iwdev <iface> station dump | grep signal
-        out = CLIENT_STA.cmd("iwdev {} station dump | grep signal".format(CLIENT_STA.name))
-        # Output example: "signal: -65 dBm"
-        m = re.search(r"signal:\s*(-\d+)", out)
+        # Output example: "signal: -65 dBm" (grep is done by _RE_RSSI)
+        m = _RE_RSSI.search(out)
         return int(m.group(1)) if m else -100
     except:
         return -100
 
+def get_client_stats():
+    """
+    Latency, jitter, loss and RSSI of the client from one run of the
+    batched probe script.
+    """
+    try:
+        out = _cmd(CLIENT_STA, _PROBE_CMD)
+    except Exception as e:
+        out = ""
+    _, _, out = out.partition("---LAT---")
+    ping_out, _, rssi_out = out.partition("---RSSI---")
+    lat, jit, loss = parse_ping_stats(ping_out)
+    return lat, jit, loss, parse_wireless_rssi(rssi_out)
+
+def _cpu_jiffies(out):
+    # "cpu  user nice system idle iowait irq softirq steal guest guest_nice"
+    # -> (idle + iowait, total), or None if there is no aggregate cpu line
+    cpu_match = _RE_CPU.search(out)
+    if not cpu_match:
+        return None
+    jiffies = [int(v) for v in cpu_match.group(1).split()]
+    return jiffies[3] + jiffies[4], sum(jiffies[:8])  # guest time is already in user
+
 def get_server_resources():
     """
-    Gets CPU and RAM usage of the Edge Server (sta4).
-    Uses standard Linux commands available in Mininet-WiFi Ubuntu images.
+    Gets CPU and RAM usage of the Edge Server (fog1).
+    Reads /proc/stat and /proc/meminfo in a single exec; CPU% is computed
+    from the jiffy deltas since the previous call.
     """
+    global _prev_cpu_idle, _prev_cpu_total
     cpu_load = 0.0
     ram_load = 0.0
     
     try:
+        out = _cmd(SERVER_STA, _SERVER_CMD)
+        
         # --- CPU ---
-        # top -bn1 gives snapshot. grep Cpu(s). awk gets idle % (usually 4th column)
-        # Example: "Cpu(s):  2.3%us,  1.0%sy,  0.0%ni, 96.7%id, ..."
-        cpu_out = SERVER_STA.cmd("top -bn1 | grep 'Cpu(s)'")
-        idle_match = re.search(r"(\d+\.\d+)\%id", cpu_out)
-        if idle_match:
-            cpu_load = 100.0 - float(idle_match.group(1))
+        cpu_jiffies = _cpu_jiffies(out)
+        if cpu_jiffies:
+            idle, total = cpu_jiffies
+            d_idle = idle - _prev_cpu_idle
+            d_total = total - _prev_cpu_total
+            _prev_cpu_idle, _prev_cpu_total = idle, total
+            if d_total > 0:
+                cpu_load = 100.0 * (1.0 - d_idle / d_total)
         else:
-            # Fallback if 'id' not found (some top versions differ)
-            cpu_load = 50.0 
+            cpu_load = 50.0
             
         # --- RAM ---
-        # free -m | awk 'NR==2{printf "%.2f", $3*100/$2}'
-        ram_out = SERVER_STA.cmd("free -m | awk 'NR==2{printf \"%.2f\", $3*100/$2}'")
-        if ram_out:
-            ram_load = float(ram_out.strip())
+        mem_total = _RE_MEMTOTAL.search(out)
+        mem_avail = _RE_MEMAVAIL.search(out)
+        if mem_total and mem_avail:
+            ram_load = 100.0 * (1.0 - int(mem_avail.group(1)) / int(mem_total.group(1)))
             
     except Exception as e:
         # If commands fail, return neutral values so script doesn't crash
@@ -120,91 +347,335 @@ def get_server_resources():
         
     return cpu_load, ram_load
 
+def counter_delta(current, previous):
+    """
+    Difference between two samples of an unsigned 64-bit OVS counter.
+    A wrap past 2^64 is unwrapped; any other decrease means the counter
+    was reset (e.g. port re-created) and is clamped to 0.
+    """
+    delta = current - previous
+    if delta < 0:
+        delta = delta + (1 << 64) if previous >= (1 << 63) else 0
+    return delta
+
+# --- STATE LABEL THRESHOLDS ---
+# Shared by calculate_state_label() and calculate_state_labels()
+HIGH_LAT_MS, MEDIUM_LAT_MS = 50, 20
+HIGH_LOSS_PCT, MEDIUM_LOSS_PCT = 5, 1
+HIGH_DROPS = 1000
+HIGH_BW_MBPS = 2                       # Only applied when bw was measured (>= 0)
+HIGH_RSSI_DBM, MEDIUM_RSSI_DBM = -75, -65
+HIGH_CPU_PCT, MEDIUM_CPU_PCT = 90, 70
+HIGH_RAM_PCT, MEDIUM_RAM_PCT = 90, 70
+
 def calculate_state_label(lat, loss, drops, bw, rssi, cpu, ram):
     """
     Determines congestion/state label based on Network + Compute resources.
     Critical for DQN reward shaping.
     """
     # HIGH RISK: Bad network OR saturated server
-    if (lat > 50 or loss > 5 or drops > 1000 or bw < 2 or rssi < -75 or 
-        cpu > 90 or ram > 90):
+    # (bw < 0 means the probe was skipped/deferred: not measured, not low)
+    if (lat > HIGH_LAT_MS or loss > HIGH_LOSS_PCT or drops > HIGH_DROPS or
+        0 <= bw < HIGH_BW_MBPS or rssi < HIGH_RSSI_DBM or
+        cpu > HIGH_CPU_PCT or ram > HIGH_RAM_PCT):
         return "HIGH"
     
     # MEDIUM RISK: Moderate congestion or load
-    elif (lat > 20 or loss > 1 or rssi < -65 or 
-          cpu > 70 or ram > 70):
+    elif (lat > MEDIUM_LAT_MS or loss > MEDIUM_LOSS_PCT or rssi < MEDIUM_RSSI_DBM or
+          cpu > MEDIUM_CPU_PCT or ram > MEDIUM_RAM_PCT):
         return "MEDIUM"
     
     # LOW RISK: Good conditions
     else:
         return "LOW"
 
-# --- MAIN LOGGER LOOP ---
+def calculate_state_labels(arr):
+    """
+    Vectorized calculate_state_label() for retro-labeling a whole trace
+    (e.g. DQN replay-buffer construction).
+
+    arr is a structured ndarray with fields lat, loss, drops, bw, rssi,
+    cpu, ram. Returns an array of "HIGH"/"MEDIUM"/"LOW" using the same
+    threshold constants as the scalar version, which stays in the live
+    loop where a single row is cheaper to compare than to wrap in an array.
+    """
+    high = ((arr['lat'] > HIGH_LAT_MS) | (arr['loss'] > HIGH_LOSS_PCT) |
+            (arr['drops'] > HIGH_DROPS) |
+            ((arr['bw'] >= 0) & (arr['bw'] < HIGH_BW_MBPS)) |
+            (arr['rssi'] < HIGH_RSSI_DBM) |
+            (arr['cpu'] > HIGH_CPU_PCT) | (arr['ram'] > HIGH_RAM_PCT))
+    medium = ((arr['lat'] > MEDIUM_LAT_MS) | (arr['loss'] > MEDIUM_LOSS_PCT) |
+              (arr['rssi'] < MEDIUM_RSSI_DBM) |
+              (arr['cpu'] > MEDIUM_CPU_PCT) | (arr['ram'] > MEDIUM_RAM_PCT))
+    return np.where(high, "HIGH", np.where(medium, "MEDIUM", "LOW"))
+
+# --- RECENT SAMPLES RING BUFFER ---
+# Fixed-size ring of the last WINDOW samples (one column per metric).
+# Field names match calculate_state_labels() so the window can be
+# relabeled in one vectorized call.
+SAMPLES = np.zeros(WINDOW, dtype=[
+    ('lat', 'f4'), ('jit', 'f4'), ('loss', 'f4'), ('bw', 'f4'),
+    ('drops', 'i8'), ('dtx', 'f8'), ('drx', 'f8'), ('rssi', 'i2'),
+    ('cpu', 'f4'), ('ram', 'f4'),
+])
+_sample_idx = 0    # Next slot to write
+_sample_count = 0  # Valid samples (< WINDOW until the ring fills)
+
+def record_sample(*row):
+    """Store one tick's metrics (in SAMPLES field order) in the ring."""
+    global _sample_idx, _sample_count
+    SAMPLES[_sample_idx] = row
+    _sample_idx = (_sample_idx + 1) % WINDOW
+    _sample_count = min(_sample_count + 1, WINDOW)
+
+def recent_samples(n):
+    """Last n samples from the ring, oldest first."""
+    n = min(n, _sample_count)
+    return SAMPLES[(_sample_idx - n + np.arange(n)) % WINDOW]
 
-print(f"Starting Network Profiler for {DURATION}s...")
-print(f"Client: {CLIENT_STA.name} | Server: {SERVER_STA.name} | AP: {SWITCH_AP.name}")
-start_time = time.time()
-iteration = 0
+def network_busy():
+    """
+    True when user traffic is already high or the switch is dropping:
+    an iperf burst now would both disturb it and bias the next samples.
+    """
+    recent = recent_samples(BUSY_WINDOW)
+    if len(recent) == 0:
+        return False
+    # Rates of -1 (not measured) would drag the average down
+    measured = recent[recent['dtx'] >= 0]
+    avg_mbps = (measured['dtx'] + measured['drx']).mean() * 8 / 1e6 if len(measured) else 0.0
+    return avg_mbps > BUSY_MBPS or recent['drops'][-1] > recent['drops'][0]
+
+def _on_sigterm(signum, frame):
+    # Unwind the loop so the finally/with blocks flush and close the CSV
+    raise SystemExit(0)
 
-# Initialize previous byte counters for delta calculation
-prev_tx, prev_rx = 0, 0
+# --- MAIN LOGGER LOOP ---
 
-with open(OUTPUT_FILE, "w", newline="") as f:
-    writer = csv.writer(f)
-    # Updated Header with CPU/RAM
-    writer.writerow([
-        "timestamp", "latency_ms", "jitter_ms", "loss_pct", 
-        "bandwidth_mbps", "queue_drops", "delta_tx_bytes", "delta_rx_bytes", 
-        "rssi_dbm", "server_cpu_pct", "server_ram_pct", "congestion_state"
-    ])
+def run(client, server, switch, server_ip, core=LOGGER_CORE, stop_event=None):
+    """
+    Profiles the topology for DURATION seconds and writes OUTPUT_FILE
+    (fixed-width CSV) and BINARY_FILE (float32 column store).
+    
+    Started on request from the Mininet CLI once the traffic is running,
+    e.g. py __import__('tracer_logger').run(sta3, fog1, ap1, '10.0.0.100');
+    it blocks until DURATION elapses or Ctrl-C. The calling thread, its
+    probe pool threads and the iperf3 client it popen()s (also given -A)
+    are pinned to `core` for the duration of the run; pass core=None to
+    leave affinity alone. ping, iw, cat and ovs-vsctl run in the nodes'
+    existing shells and keep those shells' affinity.
+    
+    The loop also ends early once `stop_event` (a threading.Event) is set;
+    start() uses this to run the profiler in a background thread. Raises
+    RuntimeError if another run is still in progress.
+    """
+    if not _RUN_LOCK.acquire(blocking=False):
+        raise RuntimeError("The profiler is already running; stop() it first")
+    prev_affinity = None
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            # pid 0 = calling thread on Linux; pool threads inherit it
+            prev_affinity = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, {core})
+        except OSError as e:
+            print(f"WARNING: could not pin logger to core {core}: {e}")
+            core = None
+    
+    # Signal handlers can only be installed from the main thread; in a
+    # background thread start() stops the loop through stop_event instead
+    prev_sigterm = None
+    if threading.current_thread() is threading.main_thread():
+        prev_sigterm = signal.signal(signal.SIGTERM, _on_sigterm)
     
     try:
-        while (time.time() - start_time) < DURATION:
-            loop_start = time.time()
-            iteration += 1
-            
-            # 1. Network Metrics
-            lat, jit, loss = get_ping_stats()
-            tx, rx, drops = get_switch_stats()
-            rssi = get_wireless_rssi()
-            
-            # 2. Server Compute Metrics (NEW)
-            cpu, ram = get_server_resources()
-            
-            # Calculate Delta (Throughput) instead of absolute bytes
-            delta_tx = tx - prev_tx
-            delta_rx = rx - prev_tx
-            prev_tx, prev_rx = tx, rx
+        _profile(client, server, switch, server_ip, core,
+                 stop_event or threading.Event())
+    finally:
+        # From the CLI this is the Mininet main thread: hand it back as found
+        if prev_sigterm is not None:
+            signal.signal(signal.SIGTERM, prev_sigterm)
+        if prev_affinity is not None:
+            os.sched_setaffinity(0, prev_affinity)
+        _RUN_LOCK.release()
+
+def _profile(client, server, switch, server_ip, core, stop_event):
+    # Body of run(), called with affinity and SIGTERM already set up
+    print(f"Starting Network Profiler for {DURATION}s...")
+    print(f"Client: {client.name} | Server: {server.name} | AP: {switch.name}")
+        
+    _setup(client, server, switch, server_ip, core)
+        
+    # Monotonic clock for all loop timing: immune to NTP/wall-clock jumps
+    start_mono = time.monotonic()
+    next_deadline = start_mono
+    iteration = 0
+        
+    # Probes are independent and mostly block on subprocess round-trips:
+    # run them concurrently so a tick costs max() rather than sum() of them
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+        
+    # iperf3 runs in the background between ticks (see start_bandwidth_probe)
+    bw_proc = None
+    bw_deadline = 0.0
+        
+    # Initialize previous byte counters for rate calculation
+    prev_tx, prev_rx = 0, 0
+    prev_stamp = None
+    drops = 0  # Kept from the last good sample when a switch read fails
+        
+    with open(OUTPUT_FILE, "w", newline="", buffering=1 << 16) as f, \
+         open(BINARY_FILE, "wb", buffering=1 << 16) as bin_f:
+        # Rows are buffered in memory; flush periodically instead of per row
+        atexit.register(f.flush)
+        atexit.register(bin_f.flush)
+        # Updated Header with CPU/RAM (csv.writer only for the header; data
+        # rows are formatted directly in the loop)
+        csv.writer(f, lineterminator="\n").writerow([
+            "timestamp", "latency_ms", "jitter_ms", "loss_pct", 
+            "bandwidth_mbps", "queue_drops", "tx_bytes_per_sec", "rx_bytes_per_sec", 
+            "rssi_dbm", "server_cpu_pct", "server_ram_pct", "congestion_state"
+        ])
             
-            # 3. Bandwidth Probe (Only every N iterations to avoid saturation)
-            bw = 0.0
-            if iteration % IPERF_FREQ == 0:
-                bw = get_bandwidth()
-            else:
+        try:
+            while (time.monotonic() - start_mono) < DURATION and not stop_event.is_set():
+                iteration += 1
+                
+                # 1. Launch all probes for this tick
+                client_future = pool.submit(get_client_stats)
+                switch_future = pool.submit(get_switch_stats)
+                server_future = pool.submit(get_server_resources)
+                
+                # 2. Network + Server Compute Metrics
+                lat, jit, loss, rssi = client_future.result()
+                switch_stats = switch_future.result()
+                cpu, ram = server_future.result()
+                
+                # Calculate Throughput (bytes/sec) instead of absolute bytes,
+                # over the time between the two counter samples themselves.
+                # -1.0 marks "not measured" (failed read, first sample or
+                # counters not refreshed yet), as for bw
+                delta_tx = delta_rx = -1.0
+                if switch_stats is not None:
+                    tx, rx, drops, stamp = switch_stats
+                    if prev_stamp is None or stamp < prev_stamp:
+                        # First sample, or port re-created: new baseline
+                        prev_tx, prev_rx, prev_stamp = tx, rx, stamp
+                    elif stamp > prev_stamp:
+                        elapsed_since_last_switch_stats = stamp - prev_stamp
+                        delta_tx = counter_delta(tx, prev_tx) / elapsed_since_last_switch_stats
+                        delta_rx = counter_delta(rx, prev_rx) / elapsed_since_last_switch_stats
+                        prev_tx, prev_rx, prev_stamp = tx, rx, stamp
+                    # Same stamp: counters not refreshed yet, keep the baseline
+                
+                # 3. Bandwidth Probe (Only every N iterations, and not while busy)
+                # Collect a probe launched on an earlier tick, if it has finished
                 bw = -1.0 # Mark as "not measured"
-            
-            # 4. Label (Includes CPU/RAM now)
-            label = calculate_state_label(lat, loss, drops, bw, rssi, cpu, ram)
-            
-            # 5. Log
-            now = int(time.time() - start_time)
-            writer.writerow([
-                now, lat, jit, loss, bw, drops, delta_tx, delta_rx, 
-                rssi, cpu, ram, label
-            ])
+                if bw_proc is not None:
+                    result = finish_bandwidth_probe(bw_proc, bw_deadline)
+                    if result is not None:
+                        bw = result
+                        bw_proc = None
+                
+                record_sample(lat, jit, loss, bw, drops, delta_tx, delta_rx,
+                              rssi, cpu, ram)
+                
+                # Launch after this tick's probes so the burst does not overlap
+                # them; IPERF_FREQ is an upper bound, deferred while busy
+                if bw_proc is None and iteration % IPERF_FREQ == 0 and not network_busy():
+                    bw_proc = start_bandwidth_probe()
+                    # A 1 s probe is long done by then; killed if still running
+                    bw_deadline = time.monotonic() + INTERVAL
+                
+                # 4. Label (Includes CPU/RAM now)
+                label = calculate_state_label(lat, loss, drops, bw, rssi, cpu, ram)
+                
+                # 5. Log
+                now = int(time.monotonic() - start_mono)
+                # All fields are numeric: no csv quoting needed
+                code = LABEL_CODES[label]
+                f.write(ROW_FORMAT.format(now, lat, jit, loss, bw, drops,
+                                          delta_tx, delta_rx, rssi, cpu, ram, code))
+                # tobytes() + write() goes through bin_f's buffer; tofile()
+                # would bypass it and cost a write syscall per row
+                bin_f.write(np.array([now, lat, jit, loss, bw, drops, delta_tx, delta_rx,
+                                      rssi, cpu, ram, code],
+                                     dtype=np.float32).tobytes())
+                if iteration % FLUSH_EVERY == 0:
+                    f.flush()
+                    bin_f.flush()
+                
+                # 6. Console Output
+                print(f"[{now}s] Lat={lat:.2f}ms Loss={loss:.1f}% RSSI={rssi}dBm CPU={cpu:.1f}% RAM={ram:.1f}% | {label}")
+                
+                # 7. Next-deadline scheduling: samples land on INTERVAL
+                # multiples; an overrun skips whole slots instead of firing
+                # the following ticks back-to-back
+                next_deadline += INTERVAL
+                sleep_time = next_deadline - time.monotonic()
+                if sleep_time < 0:
+                    missed = int(-sleep_time // INTERVAL) + 1
+                    next_deadline += missed * INTERVAL
+                    sleep_time = next_deadline - time.monotonic()
+                    print(f"[{now}s] Sample dropped: tick overran, skipping {missed} slot(s)")
+                stop_event.wait(max(0, sleep_time))
+                
+        except KeyboardInterrupt:
+            print("\nProfiler stopped by user.")
+        except Exception as e:
+            print(f"\nCritical Error: {e}")
+        finally:
+            pool.shutdown(wait=False)
+            if bw_proc is not None and bw_proc.poll() is None:
+                bw_proc.kill()
+            _stop_iperf_server()
             f.flush()
-            
-            # 6. Console Output
-            print(f"[{now}s] Lat={lat:.2f}ms Loss={loss:.1f}% RSSI={rssi}dBm CPU={cpu:.1f}% RAM={ram:.1f}% | {label}")
-            
-            # 7. Sleep Compensation
-            elapsed = time.time() - loop_start
-            sleep_time = max(0, INTERVAL - elapsed)
-            time.sleep(sleep_time)
-            
-    except KeyboardInterrupt:
-        print("\nProfiler stopped by user.")
-    except Exception as e:
-        print(f"\nCritical Error: {e}")
-    finally:
-        print(f"Data saved to {OUTPUT_FILE}")
+            bin_f.flush()
+            atexit.unregister(f.flush)
+            atexit.unregister(bin_f.flush)
+            print(f"Data saved to {OUTPUT_FILE} and {BINARY_FILE}")
+
+def start(client, server, switch, server_ip, core=LOGGER_CORE):
+    """
+    Runs run() in a daemon thread and returns that thread, e.g.
+    py __import__('tracer_logger').start(sta3, fog1, ap1, '10.0.0.100')
+    
+    The probes share the node shells with the CLI: do not run commands on
+    the client, server or switch node until the run ends, or both sides
+    fail (Mininet allows one command per shell at a time) and the trace
+    gets bogus rows. Raises RuntimeError if a run is still in progress.
+    
+    Must be called from the main thread (the CLI's py command is), where
+    SIGTERM is delivered: the handler installed here stops the thread so
+    the trace files are flushed, then re-raises SIGTERM with the previous
+    handler. stop() ends the run early.
+    """
+    global _STOP_EVENT, _THREAD
+    if (_THREAD is not None and _THREAD.is_alive()) or _RUN_LOCK.locked():
+        raise RuntimeError("The profiler is already running; stop() it first")
+    _STOP_EVENT = stop_event = threading.Event()
+    _THREAD = thread = threading.Thread(
+        target=run, args=(client, server, switch, server_ip),
+        kwargs={"core": core, "stop_event": stop_event}, daemon=True)
+    prev_sigterm = signal.getsignal(signal.SIGTERM)
+    if prev_sigterm is None:
+        prev_sigterm = signal.SIG_DFL
+    
+    def on_sigterm(signum, frame):
+        stop_event.set()
+        # A tick in progress finishes first; it never takes much over INTERVAL
+        thread.join(timeout=2 * INTERVAL)
+        signal.signal(signal.SIGTERM, prev_sigterm)
+        os.kill(os.getpid(), signal.SIGTERM)
+    
+    signal.signal(signal.SIGTERM, on_sigterm)
+    thread.start()
+    return thread
+
+def stop():
+    """Ends a run started with start(); the thread flushes and exits."""
+    if _STOP_EVENT is not None:
+        _STOP_EVENT.set()
+
+if __name__ == "__main__":
+    # Needs live Mininet node handles: import this module and call run()
+    sys.exit("ERROR: start the profiler with tracer_logger.run(client, server, switch, server_ip)")